@@ -5,7 +5,9 @@ from .ne2001 import (
 
 from .factors import hwhm_f, fwhm_f, hwem_f, fwem_f
 
-from .frame_processing import tnorm, extract_ts, get_metadata
+from .frame_processing import (
+    tnorm, tnorm_slice_integrate, extract_ts, get_metadata
+)
 
 from .bounds import (
     plot_bounds, polyfit_bounds, threshold_bounds, threshold_baseline_bounds,
@@ -18,16 +20,16 @@ from .sample_t_d import (
 )
 
 from .simulations import (
-    get_ts_arta, get_ts_fft, get_ts_pdf, SignalGenerator, synthesize_dataset,
-    c95, hl07, rd18
+    get_ts_arta, get_ts_fft, get_ts_pdf, get_ts_pdf_batch, 
+    SignalGenerator, synthesize_dataset, c95, hl07, rd18
 )
 
 from .bl_obs import check_btl
 
 from .diag_stats import (
-    acf, autocorr, get_diag_stats, empty_diag_stats, fit_acf, triangle, 
-    scint_acf, noisy_scint_acf, noisy_scint_acf_gen, ts_plots, ts_stat_plots, 
-    ts_ac_plot
+    acf, autocorr, short_lag_acf, get_diag_stats, empty_diag_stats, fit_acf, 
+    triangle, scint_acf, noisy_scint_acf, noisy_scint_acf_gen, ts_plots, 
+    ts_stat_plots, ts_ac_plot
 )
 
 from .hit_parser import HitParser
@@ -1,5 +1,6 @@
 import os
 import sys
+import re
 import glob
 import numpy as np
 import pandas as pd
@@ -7,7 +8,9 @@ import setigen as stg
 import blimpy as bl
 import matplotlib.pyplot as plt
 import tqdm
-import collections
+import functools
+import multiprocessing
+import concurrent.futures
 
 from astropy import units as u
 from astropy.stats import sigma_clip
@@ -19,11 +22,38 @@ from . import bounds
 from . import dataframe
 from . import frame_processing
 from . import diag_stats
-from . import gen_arta
+from . import simulations
 
 import jort
 
 
+class _NullTracker(object):
+    """
+    Stand-in for jort.Tracker with the same interface, which skips all
+    timing. Used unless profiling is requested.
+    """
+    def start(self, *args, **kwargs):
+        pass
+
+    def stop(self, *args, **kwargs):
+        pass
+
+    def remove(self, *args, **kwargs):
+        pass
+
+    def report(self, *args, **kwargs):
+        pass
+
+
+def _get_tracker(profile=False):
+    """
+    Get jort.Tracker if profiling, otherwise a no-op tracker.
+    """
+    if profile:
+        return jort.Tracker()
+    return _NullTracker()
+
+
 def as_file_list(fns, node_excludes=[], str_excludes=[]):
     """
     Expand files, using glob pattern matching, into a full list.
@@ -48,15 +78,50 @@ def as_file_list(fns, node_excludes=[], str_excludes=[]):
         fns = [fns]
     fns = [fn for exp_fns in fns for fn in glob.glob(exp_fns)]
     fns.sort()
-    for exclude_str in node_excludes:
-        exclude_str = f"{int(exclude_str):02d}"
-        fns = [fn for fn in fns if f"blc{exclude_str}" not in fn]
-    for exclude_str in str_excludes:
-        fns = [fn for fn in fns if exclude_str not in fn]
+    excludes = [f"blc{int(node):02d}" for node in node_excludes] + list(str_excludes)
+    if len(excludes) > 0:
+        # Filter all exclusion strings in a single pass
+        exclude_re = re.compile("|".join(map(re.escape, excludes)))
+        fns = [fn for fn in fns if not exclude_re.search(fn)]
     return fns
 
 
-def run_turboseti(obs_fns, min_drift=0.00001, max_drift=5, snr=10, out_dir='.', gpu_id=0, replace_existing=False):
+def _run_turboseti_file(data_fn, min_drift=0.00001, max_drift=5, snr=10, 
+                        out_dir='.', gpu_backend=True, gpu_id=0, 
+                        replace_existing=False):
+    """
+    Run TurboSETI on a single observation file, unless results already exist.
+    
+    Returns
+    -------
+    turbo_dat_fn : str
+        TurboSETI .dat file created, or None if skipped
+    """
+    # First, check if equivalent h5 data file exists in either source or target directory
+    h5_fn_old = f"{os.path.splitext(data_fn)[0]}.h5"
+    h5_fn_new = f"{out_dir}/{os.path.splitext(os.path.basename(data_fn))[0]}.h5"
+    if os.path.exists(h5_fn_old):
+        data_fn = h5_fn_old
+    elif os.path.exists(h5_fn_new):
+        print("Using H5 file in target directory")
+        data_fn = h5_fn_new
+    turbo_dat_fn = f"{out_dir}/{os.path.splitext(os.path.basename(data_fn))[0]}.dat"
+    if not os.path.exists(turbo_dat_fn) or replace_existing:
+        find_seti_event = FindDoppler(data_fn,
+                                      min_drift=min_drift,
+                                      max_drift=max_drift,
+                                      snr=snr,
+                                      out_dir=out_dir,
+                                      gpu_backend=gpu_backend,
+                                      gpu_id=gpu_id,
+                                      precision=1)
+        find_seti_event.search()
+        return turbo_dat_fn
+    return None
+
+
+def run_turboseti(obs_fns, min_drift=0.00001, max_drift=5, snr=10, out_dir='.', 
+                  gpu_id=0, replace_existing=False, processes=None):
     """
     Run TurboSETI on all observation files. 
     Accept observation as input, return and save csv as output (via pandas).
@@ -74,47 +139,48 @@ def run_turboseti(obs_fns, min_drift=0.00001, max_drift=5, snr=10, out_dir='.',
     out_dir : str, optional
         Output directory for .dat files
     gpu_id : int, optional
-        ID of GPU used for analysis
+        ID of GPU used for analysis. If 5, run on CPU instead.
     replace_existing : bool, optional
         Option to overwrite existing .dat files
+    processes : int, optional
+        Number of files to search concurrently when running on CPU. If None,
+        use half of the available CPUs. GPU searches always run serially.
         
     Returns
     -------
     turbo_dat_list : list
         List of all turboseti .dat files created
     """
+    if gpu_id == 5:
+        gpu_backend = False
+        gpu_id = 0
+    else:
+        gpu_backend = True
+    run_file = functools.partial(_run_turboseti_file,
+                                 min_drift=min_drift,
+                                 max_drift=max_drift,
+                                 snr=snr,
+                                 out_dir=out_dir,
+                                 gpu_backend=gpu_backend,
+                                 gpu_id=gpu_id,
+                                 replace_existing=replace_existing)
+    data_fns = as_file_list(obs_fns)
+
     tr = jort.Tracker()
-    turbo_dat_list = []
-    for data_fn in as_file_list(obs_fns):
-       
-        # First, check if equivalent h5 data file exists in either source or target directory
-        h5_fn_old = f"{os.path.splitext(data_fn)[0]}.h5"
-        h5_fn_new = f"{out_dir}/{os.path.splitext(os.path.basename(data_fn))[0]}.h5"
-        if os.path.exists(h5_fn_old):
-            data_fn = h5_fn_old
-        elif os.path.exists(h5_fn_new):
-            print("Using H5 file in target directory")
-            data_fn = h5_fn_new
-        if gpu_id == 5:
-            gpu_backend=False
-            gpu_id=0
-        else:
-            gpu_backend=True
-        turbo_dat_fn = f"{out_dir}/{os.path.splitext(os.path.basename(data_fn))[0]}.dat"
-        if not os.path.exists(turbo_dat_fn) or replace_existing:
+    if gpu_backend:
+        turbo_dat_fns = []
+        for data_fn in data_fns:
             tr.start('turboseti')
-            find_seti_event = FindDoppler(data_fn,
-                                          min_drift=min_drift,
-                                          max_drift=max_drift,
-                                          snr=snr,
-                                          out_dir=out_dir,
-                                          gpu_backend=gpu_backend,
-                                          gpu_id=gpu_id,
-                                          precision=1)
-            find_seti_event.search()
-            turbo_dat_list.append(turbo_dat_fn)
+            turbo_dat_fns.append(run_file(data_fn))
             tr.stop('turboseti')
-    tr.report()
+        tr.report()
+    else:
+        # Files are independent, so search several at once on CPU
+        if processes is None:
+            processes = max(1, os.cpu_count() // 2)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            turbo_dat_fns = list(executor.map(run_file, data_fns))
+    turbo_dat_list = [fn for fn in turbo_dat_fns if fn is not None]
     return turbo_dat_list
 
 
@@ -131,7 +197,7 @@ def get_bbox_frame(index, df):
         Pandas dataframe with TurboSETI parameters
     """
     row = df.loc[index]
-    param_dict = dataframe.get_frame_params(row['fn'])
+    param_dict = _get_frame_params(row['fn'])
     frame = dataframe.turbo_centered_frame(index, df, row['fn'], row['fchans'], **param_dict)
     frame = stg.dedrift(frame)
     return frame
@@ -173,13 +239,147 @@ def empty_ts_stats(fchans):
     return ts_stats
 
 
+# Width of frame loaded and dedrifted once a hit needs a retry, from which narrower 
+# frames are sliced while searching for a bounded signal
+_WIDE_FCHANS = 1024
+
+
+@functools.lru_cache(maxsize=128)
+def _cached_frame_params(fn):
+    return tuple(dataframe.get_frame_params(fn).items())
+
+
+def _get_frame_params(fn):
+    """
+    Get frame resolution from a spectrogram file, only reading each file 
+    header once. Returns a new dictionary, so callers may modify it.
+    """
+    return dict(_cached_frame_params(fn))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_frame_loader(data_fn):
+    """
+    Get FrameLoader for a datafile, kept per process so that consecutive 
+    hits reuse data already in memory.
+    """
+    return dataframe.FrameLoader(data_fn)
+
+
+def _process_hit(index, df, data_fn, param_dict, bound_type='threshold', 
+                 divide_std=False, tr=None):
+    """
+    Compute boundary box statistics for a single TurboSETI hit. Frames are
+    loaded here so that only hit parameters need to be sent to workers.
+
+    Parameters
+    ----------
+    index : int
+        Signal index
+    df : DataFrame
+        Pandas dataframe with TurboSETI parameters
+    data_fn : str
+        Filename of datafile
+    param_dict : dict
+        Dictionary with tchans, df, dt of datafile
+    bound_type : str, optional
+        Type of frequency bounding to use, between 'snr' and 'threshold'
+    divide_std : bool, optional
+        Normalize each spectrum by dividing by its standard deviation 
+    tr : jort.Tracker, optional
+        Tracker for timing individual steps. If None, steps are not timed.
+        
+    Returns
+    -------
+    ts_stats : dict
+        Dictionary of statistics
+    """
+    if tr is None:
+        tr = _NullTracker()
+    loader = _get_frame_loader(data_fn)
+    # Most hits are bounded at the first width. After a failed fit, dedrift
+    # one wide frame and take later, narrower attempts as central slices.
+    wide_frame = None
+    retrying = False
+    use_wide = True
+    found_peak = False
+    fchans = 256
+    while not found_peak:
+        try:
+            tr.start('frame_init')
+            if retrying and use_wide and (wide_frame is None or fchans > wide_frame.fchans):
+                wide_fchans = max(fchans, _WIDE_FCHANS)
+                wide_frame = dataframe.turbo_centered_frame(index, df, loader, wide_fchans, **param_dict)
+                wide_frame = stg.dedrift(wide_frame)
+                # Allow for rounding, but not truncation at the band edges
+                if abs(wide_frame.fchans - wide_fchans) > 1:
+                    wide_frame = None
+                    use_wide = False
+            if wide_frame is None:
+                frame = dataframe.turbo_centered_frame(index, df, loader, fchans, **param_dict)
+                frame = stg.dedrift(frame)
+            elif fchans < wide_frame.fchans:
+                offset = (wide_frame.fchans - fchans) // 2
+                frame = wide_frame.get_slice(offset, offset + fchans)
+            else:
+                frame = wide_frame
+            tr.stop('frame_init')
+                    
+            spec = frame.integrate()
+
+            tr.start('polyfit')
+            l, r, metadata = bounds.polyfit_bounds(spec, deg=1, snr_threshold=10)
+            tr.stop('polyfit')
+
+            found_peak = True
+        except ValueError:
+            # If no fit found, or out of bounds
+            fchans *= 2
+            retrying = True
+            tr.remove('polyfit')
+        except IndexError:
+            # Broadband interferer
+            l, r, metadata = None, None, None
+            ts_stats = empty_ts_stats(fchans)
+            tr.remove('polyfit')
+            break
+
+    # If IndexError... was probably not narrowband signal,
+    # so just skip adding it in
+    if l is not None:
+        try:
+            tr.start('bounds')
+            if bound_type == 'snr':
+                l, r, metadata = bounds.snr_bounds(spec, snr=5)
+            else:
+                l, r, metadata = bounds.threshold_baseline_bounds(spec)
+            # print(l,r)
+            tr.stop('bounds')
+
+            # Get time series and normalize
+            ts = frame_processing.tnorm_slice_integrate(frame, l, r, 
+                                                        divide_std=divide_std)
+
+            ts_stats = diag_stats.get_diag_stats(ts)
+            ts_stats['fchans'] = fchans
+            ts_stats['l'] = l
+            ts_stats['r'] = r
+
+        except IndexError:
+            tr.remove('bounds')
+            ts_stats = empty_ts_stats(fchans)
+    return ts_stats
+
+
 def run_bbox_stats(turbo_dat_fns, 
                    data_dir='.', 
                    data_ext='.fil', 
                    data_res_ext='.0005', 
                    replace_existing=False,
                    bound_type='threshold',
-                   divide_std=False):
+                   divide_std=False,
+                   processes=1,
+                   profile=False):
     """
     Accept TurboSETI .dat files as input, return and save csv as output (via pandas).
     Boundary box statistics.
@@ -201,13 +401,18 @@ def run_bbox_stats(turbo_dat_fns,
         Type of frequency bounding to use, between 'snr' and 'threshold'
     divide_std : bool, optional
         Normalize each spectrum by dividing by its standard deviation 
+    processes : int, optional
+        Number of worker processes over which to split hits. If None, use 
+        all available CPUs. Step timing is only reported for serial runs.
+    profile : bool, optional
+        Option to time individual steps with jort and print a report
         
     Returns
     -------
     csv_list : list
         List of all .csv files created
     """
-    tr = jort.Tracker()
+    tr = _get_tracker(profile)
     csv_list = []
     for turbo_dat_fn in as_file_list(turbo_dat_fns):
         print(f"Working on {turbo_dat_fn}")
@@ -217,66 +422,31 @@ def run_bbox_stats(turbo_dat_fns,
         # Skip if csv already exists
         if not os.path.exists(csv_fn) or replace_existing:
             df = dataframe.make_dataframe(turbo_dat_fn)
-            param_dict = dataframe.get_frame_params(data_fn)
-
-            ts_stats_dict = collections.defaultdict(list)
-            for index, row in tqdm.tqdm(df.iterrows()):
-                found_peak = False
-                fchans = 256
-                while not found_peak:
-                    try:
-                        tr.start('frame_init')
-                        frame = dataframe.turbo_centered_frame(index, df, data_fn, fchans, **param_dict)
-                        frame = stg.dedrift(frame)
-                        tr.stop('frame_init')
-                                
-                        spec = frame.integrate()
-
-                        tr.start('polyfit')
-                        l, r, metadata = bounds.polyfit_bounds(spec, deg=1, snr_threshold=10)
-                        tr.stop('polyfit')
-
-                        found_peak = True
-                    except ValueError:
-                        # If no fit found, or out of bounds
-                        fchans *= 2
-                        tr.remove('polyfit')
-                    except IndexError:
-                        # Broadband interferer
-                        l, r, metadata = None, None, None
-                        ts_stats = empty_ts_stats(fchans)
-                        tr.remove('polyfit')
-                        break
-
-                # If IndexError... was probably not narrowband signal,
-                # so just skip adding it in
-                if l is not None:
-                    try:
-                        tr.start('bounds')
-                        if bound_type == 'snr':
-                            l, r, metadata = bounds.snr_bounds(spec, snr=5)
-                        else:
-                            l, r, metadata = bounds.threshold_baseline_bounds(spec)
-                        # print(l,r)
-                        tr.stop('bounds')
-
-                        n_frame = frame_processing.tnorm(frame, divide_std=divide_std)
-                        tr_frame = n_frame.get_slice(l, r)
-
-                        # Get time series and normalize
-                        ts = tr_frame.integrate('f')
-                        ts = ts / np.mean(ts)
-
-                        ts_stats = diag_stats.get_stats(ts)
-                        ts_stats['fchans'] = fchans
-                        ts_stats['l'] = l
-                        ts_stats['r'] = r
-
-                    except IndexError:
-                        tr.remove('bounds')
-                        ts_stats = empty_ts_stats(fchans)
-                for key in ts_stats:
-                    ts_stats_dict[f"{key}"].append(ts_stats[key])
+            param_dict = _get_frame_params(data_fn)
+
+            process_hit = functools.partial(_process_hit,
+                                            df=df,
+                                            data_fn=data_fn,
+                                            param_dict=param_dict,
+                                            bound_type=bound_type,
+                                            divide_std=divide_std)
+            if processes == 1:
+                results = [process_hit(index, tr=tr) 
+                           for index in tqdm.tqdm(df.index)]
+            else:
+                # Hits are independent, so farm out in chunks
+                n_workers = processes or os.cpu_count()
+                chunksize = max(1, len(df) // (4 * n_workers))
+                with multiprocessing.Pool(processes) as pool:
+                    results = list(tqdm.tqdm(pool.imap(process_hit, 
+                                                       df.index, 
+                                                       chunksize=chunksize),
+                                             total=len(df)))
+
+            n = len(df)
+            ts_stats_dict = {}
+            for i, ts_stats in enumerate(results):
+                diag_stats.fill_stats(ts_stats_dict, ts_stats, i, n)
 
             # Set statistic columns
             for key in ts_stats_dict:
@@ -307,7 +477,7 @@ def plot_snapshot(index, df, divide_std=False):
     """
     row = df.loc[index]
     
-    param_dict = dataframe.get_frame_params(row['fn'])
+    param_dict = _get_frame_params(row['fn'])
     frame = dataframe.turbo_centered_frame(index, df, row['fn'], row['fchans'], **param_dict)
     dd_frame = stg.dedrift(frame)
 
@@ -322,7 +492,10 @@ def plot_snapshot(index, df, divide_std=False):
     ts = tr_frame.integrate('f')
     ts = ts / np.mean(ts)
 
-    ts_stats = diag_stats.get_stats(ts)
+    ts_stats, acf = diag_stats.get_diag_stats(ts, 
+                                              compute=('std', 'min', 'ks', 'anderson', 
+                                                       'lag1', 'lag2', 'fit'), 
+                                              return_acf=True)
     
     print(f"SNR : {row['SNR']:.3}")
     for stat in ts_stats:
@@ -347,7 +520,6 @@ def plot_snapshot(index, df, divide_std=False):
     plt.title('Time series')
     
     plt.subplot(1, 4, 4)
-    acf = diag_stats.autocorr(ts)
     plt.plot(acf, c='k')
     plt.axhline(0, ls='--')
     plt.xlabel('Lag')
@@ -369,7 +541,7 @@ def plot_bounded_frame(index, df):
     """
     row = df.loc[index]
     
-    param_dict = dataframe.get_frame_params(row['fn'])
+    param_dict = _get_frame_params(row['fn'])
     frame = dataframe.turbo_centered_frame(index, df, row['fn'], row['fchans'], **param_dict)
     dd_frame = stg.dedrift(frame)
 
@@ -446,7 +618,8 @@ def plot_bbox_stats(csv_fns,
                     use_triangle=True, 
                     bound_type='threshold',
                     divide_std=False, 
-                    plot_fn_prefix='bbox_stats'):
+                    plot_fn_prefix='bbox_stats',
+                    profile=False):
     """
     Make stats plots with RFI and synthetic signals, and save result as a pdf.
 
@@ -464,11 +637,13 @@ def plot_bbox_stats(csv_fns,
         Normalize each spectrum by dividing by its standard deviation 
     plot_fn_prefix : str, optional
         Filename prefix for plot
+    profile : bool, optional
+        Option to time signal synthesis with jort and print a report
     """
     data_df = get_bbox_df(csv_fns)
     
     # Simulate signals
-    tr = jort.Tracker()
+    tr = _get_tracker(profile)
     n_samples = 1000
 
     synth_stats_dicts = {}
@@ -483,10 +658,16 @@ def plot_bbox_stats(csv_fns,
                                 ascending=False)
     for t_d in [10, 30, 100]:
         tr.start('synthesize_bbox')
-        ts_stats_dict = collections.defaultdict(list)
-
-        for _ in range(n_samples):
-            ts = gen_arta.get_ts_arta(t_d, sample_frame.dt, sample_frame.tchans, p=32, pow=pow)
+        ts_stats_dict = {}
+
+        # Generate all intensity time series for this t_d in one batch
+        ts_batch = simulations.get_ts_arta(t_d, 
+                                           sample_frame.dt, 
+                                           sample_frame.tchans, 
+                                           p=32, 
+                                           pow=pow, 
+                                           batch=n_samples)
+        for i, ts in enumerate(ts_batch):
             frame = stg.Frame(**sample_frame.get_params())
             frame.add_noise_from_obs()
             signal = frame.add_signal(stg.constant_path(f_start=frame.get_frequency(128), 
@@ -500,19 +681,18 @@ def plot_bbox_stats(csv_fns,
             else:
                 l, r, _ = bounds.threshold_baseline_bounds(frame.integrate())
 
-            n_frame = frame_processing.tnorm(frame, divide_std=divide_std)
-            tr_frame = n_frame.get_slice(l, r)
-            tr_ts = tr_frame.integrate('f')
-            tr_ts /= tr_ts.mean()
+            tr_ts = frame_processing.tnorm_slice_integrate(frame, l, r, 
+                                                           divide_std=divide_std)
 
             # Just get the stats for the detected signal
-            ts_stats = diag_stats.get_stats(tr_ts)
+            ts_stats = diag_stats.get_diag_stats(tr_ts, 
+                                                 compute=('std', 'min', 'ks', 'fit'))
 
-            for key in ts_stats:
-                ts_stats_dict[f"{key}"].append(ts_stats[key])
+            diag_stats.fill_stats(ts_stats_dict, ts_stats, i, n_samples)
 
         synth_stats_dicts[t_d] = ts_stats_dict
         tr.stop('synthesize_bbox')
+    tr.report()
     
     
     
@@ -528,7 +708,12 @@ def plot_bbox_stats(csv_fns,
 
     for j, key in enumerate(keys):
         key = f"{key}"
-        bins=np.histogram(np.hstack([synth_stats_dicts[t_d][key] for t_d in t_ds] + [data_df[key]]), bins=40)[1]
+        # Only bin edges are needed, which span the full range of values
+        lo = min([np.nanmin(synth_stats_dicts[t_d][key]) for t_d in t_ds] + [np.nanmin(data_df[key])])
+        hi = max([np.nanmax(synth_stats_dicts[t_d][key]) for t_d in t_ds] + [np.nanmax(data_df[key])])
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        bins = np.linspace(lo, hi, 41)
         for i, t_d in enumerate(t_ds):
             axs[j].hist(synth_stats_dicts[t_d][key], bins=bins, histtype='step', label=f'{t_d} s')
             axs[j].set_title(f'{key.upper()}')
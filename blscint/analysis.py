@@ -1,9 +1,9 @@
 import os
 import sys
+import re
 import glob
 from pathlib import Path
 import click 
-import collections
 import shutil
 import psutil
 import subprocess
@@ -49,11 +49,11 @@ def as_file_list(fns, node_excludes=[], str_excludes=[]):
             paths.extend(Path().glob(str(pattern)))
     
     paths.sort()
-    for exclude_str in node_excludes:
-        exclude_str = f"{int(exclude_str):02d}"
-        paths = [fn for fn in paths if f"blc{exclude_str}" not in fn.name]
-    for exclude_str in str_excludes:
-        paths = [fn for fn in paths if exclude_str not in fn.name]
+    excludes = [f"blc{int(node):02d}" for node in node_excludes] + list(str_excludes)
+    if len(excludes) > 0:
+        # Filter all exclusion strings in a single pass
+        exclude_re = re.compile("|".join(map(re.escape, excludes)))
+        paths = [fn for fn in paths if not exclude_re.search(fn.name)]
     return paths
 
 
@@ -190,8 +190,9 @@ def diagstat(filename,
                 tsdump = np.full((len(hp.df), hp.frame_metadata["tchans"]), 
                                  np.nan)
 
-            ts_stats_dict = collections.defaultdict(list)
-            for idx, row in tqdm.tqdm(hp.df.iterrows(), total=hp.df.shape[0]):
+            n = len(hp.df)
+            ts_stats_dict = {}
+            for i, idx in enumerate(tqdm.tqdm(hp.df.index)):
                 found_peak = False
                 fchans = init_fchans 
                 while not found_peak:
@@ -234,8 +235,7 @@ def diagstat(filename,
                     except IndexError:
                         ts_stats = diag_stats.empty_diag_stats(fchans)
 
-                for stat in ts_stats:
-                    ts_stats_dict[stat].append(ts_stats[stat])
+                diag_stats.fill_stats(ts_stats_dict, ts_stats, i, n)
 
             # Set statistic columns
             for stat in ts_stats_dict:
@@ -1,8 +1,10 @@
 import os
 import numpy as np
 import pandas as pd
+from astropy import units as u
 import setigen as stg
 import blimpy as bl
+from blimpy.io.hdf_reader import H5Reader
 
 
 def make_dataframe(dat_file):
@@ -65,6 +67,102 @@ def get_frame_params(fn):
     }
 
 
+class FrameLoader(object):
+    """
+    Load frames from a single datafile, reading the data one block of
+    channels at a time and slicing each frame out of memory. Hits clustered
+    in frequency then share a single read, instead of opening the file
+    for every frame.
+
+    Frames are built from copies of the data, so they don't share a
+    Waterfall object with each other.
+    """
+    def __init__(self, fn, block_fchans=2**20):
+        """
+        Parameters
+        ----------
+        fn : str
+            .fil or .h5 filename
+        block_fchans : int, optional
+            Number of channels read into memory at a time. The default 
+            matches a high frequency resolution coarse channel.
+        """
+        self.fn = str(fn)
+        self.block_fchans = block_fchans
+        # Only used to convert frequency ranges to channel indices
+        self.container = bl.Waterfall(self.fn, load_data=False).container
+
+        self._block = None
+        self._block_start = None
+
+    def _read_block(self, chan_start_idx, chan_stop_idx):
+        """
+        Read data covering a range of channels into memory, aligned to 
+        blocks of block_fchans channels.
+        """
+        c = self.container
+        lo = chan_start_idx // self.block_fchans * self.block_fchans
+        hi = -(-chan_stop_idx // self.block_fchans) * self.block_fchans
+        hi = min(hi, c.n_channels_in_file)
+        if isinstance(c, H5Reader):
+            self._block = c.h5['data'][:, :, lo:hi]
+        else:
+            data = np.memmap(self.fn,
+                             dtype=c._d_type,
+                             mode='r',
+                             offset=int(c.idx_data),
+                             shape=(c.n_ints_in_file, 
+                                    int(c.header['nifs']), 
+                                    c.n_channels_in_file))
+            self._block = np.array(data[:, :, lo:hi])
+        self._block_start = lo
+
+    def frame(self, f_start, f_stop):
+        """
+        Create Frame for a frequency range, selected the same way as 
+        bl.Waterfall(fn, f_start=f_start, f_stop=f_stop).
+
+        Parameters
+        ----------
+        f_start : float
+            Start frequency (MHz)
+        f_stop : float
+            Stop frequency (MHz)
+
+        Returns
+        -------
+        frame : stg.Frame
+            Frame with the selected data
+        """
+        c = self.container
+        c._setup_selection_range(f_start=f_start, f_stop=f_stop)
+        c._setup_chans()
+        c._setup_freqs()
+        chan_start_idx = c.chan_start_idx
+        chan_stop_idx = chan_start_idx + c.selection_shape[2]
+
+        if (self._block is None 
+                or chan_start_idx < self._block_start
+                or chan_stop_idx > self._block_start + self._block.shape[2]):
+            self._read_block(chan_start_idx, chan_stop_idx)
+        data = self._block[c.t_start:c.t_stop, 0, 
+                           chan_start_idx - self._block_start:chan_stop_idx - self._block_start]
+
+        ascending = (c.header['foff'] > 0)
+        if ascending:
+            fch1 = c.f_start
+        else:
+            fch1 = c.f_stop
+            data = data[:, ::-1]
+        return stg.Frame(df=abs(c.header['foff']) * u.MHz,
+                         dt=c.header['tsamp'] * u.s,
+                         fch1=fch1 * u.MHz,
+                         ascending=ascending,
+                         data=data,
+                         mjd=c.header['tstart'],
+                         source_name=c.header['source_name'])
+
+
 def centered_frame(fn,
                    drift_rate,
                    center_freq,
@@ -120,8 +218,9 @@ def turbo_centered_frame(i,
         Signal index
     dataframe : DataFrame
         Pandas dataframe with TurboSETI parameters
-    fn : str, optional
-        Filename of datafile (unless filename is also in the dataframe, under 'fn')
+    fn : str or FrameLoader, optional
+        Filename of datafile (unless filename is also in the dataframe, under 'fn'),
+        or a FrameLoader for the datafile, to reuse data across hits
     fchans : int, optional
         Number of frequency bins in target frame
     tchans : int, optional
@@ -136,11 +235,10 @@ def turbo_centered_frame(i,
     frame : stg.Frame
         Generated frame
     """
-    row = dataframe.loc[i]
-    drift_rate = row['DriftRate']
-    center_freq = row['Uncorrected_Frequency']
+    drift_rate = dataframe.at[i, 'DriftRate']
+    center_freq = dataframe.at[i, 'Uncorrected_Frequency']
     if fn is None:
-        fn = row['fn']
+        fn = dataframe.at[i, 'fn']
 
     adj_center_freq = center_freq + drift_rate/1e6 * tchans/2
     max_offset = int(abs(drift_rate) * tchans * dt / df)
@@ -148,10 +246,12 @@ def turbo_centered_frame(i,
         adj_fchans = [0, max_offset]
     else:
         adj_fchans = [max_offset, 0]
-    wf = bl.Waterfall(fn,
-                      f_start=adj_center_freq - (fchans/2 + adj_fchans[0]) * df/1e6,
-                      f_stop=adj_center_freq + (fchans/2 + adj_fchans[1]) * df/1e6)
-    frame = stg.Frame(wf)
+    f_start = adj_center_freq - (fchans/2 + adj_fchans[0]) * df/1e6
+    f_stop = adj_center_freq + (fchans/2 + adj_fchans[1]) * df/1e6
+    if isinstance(fn, FrameLoader):
+        frame = fn.frame(f_start, f_stop)
+    else:
+        frame = stg.Frame(bl.Waterfall(fn, f_start=f_start, f_stop=f_stop))
         
     frame.add_metadata({
         'drift_rate': drift_rate,
@@ -1,22 +1,59 @@
 import numpy as np
 from scipy import optimize
-import scipy.stats, scipy.signal
+import scipy.stats, scipy.signal, scipy.fft
 import matplotlib.pyplot as plt
 import collections
 import seaborn as sns
 import pandas as pd
+from numba import njit
 
 import setigen as stg
 from setigen.funcs import func_utils
 from . import factors
 
 
+# Up to this length (typical frame tchans), a compiled direct sum beats 
+# FFT setup overhead; measured crossover is around 700 samples
+_DIRECT_ACF_MAX_LEN = 512
+
+
+@njit(cache=True, fastmath=True)
+def _acf_numba(x, max_lag):
+    """
+    Unnormalized autocorrelation of a series about its mean up to max_lag, 
+    accumulating each lag in a single pass. Deviations from the mean are 
+    taken on the fly, so no centered copy of the series is made.
+    """
+    n = x.shape[0]
+    mu = 0.
+    for i in range(n):
+        mu += x[i]
+    mu /= n
+    acf = np.zeros(max_lag + 1)
+    for lag in range(max_lag + 1):
+        s12 = 0.
+        for i in range(n - lag):
+            s12 += (x[i] - mu) * (x[i + lag] - mu)
+        acf[lag] = s12
+    return acf
+
+
 def autocorr(ts, remove_spike=False):
     """
     Calculate full autocorrelation, normalizing time series to zero mean and unit variance.
     """
-    ts = (ts - np.mean(ts)) #/ np.std(ts)
-    acf = np.correlate(ts, ts, 'full')[-len(ts):]
+    n = len(ts)
+    if n <= _DIRECT_ACF_MAX_LEN:
+        acf = _acf_numba(np.asarray(ts, dtype=float), n - 1)
+    else:
+        # Promote (e.g. float32 synthetic series) so the FFT runs in double
+        ts = np.asarray(ts, dtype=float)
+        ts = (ts - np.mean(ts)) #/ np.std(ts)
+        # Wiener-Khinchin: power spectrum of zero-padded series gives the 
+        # (linear, not circular) autocorrelation in O(N log N)
+        nfft = scipy.fft.next_fast_len(2 * n - 1, real=True)
+        spec = scipy.fft.rfft(ts, n=nfft)
+        acf = scipy.fft.irfft(spec.real**2 + spec.imag**2, n=nfft)[:n]
     if remove_spike:
         acf[0] = acf[1]
     acf /= acf[0] # This is essentially the variance (scaled by len(ts))
@@ -25,43 +62,96 @@ def autocorr(ts, remove_spike=False):
 
 def acf(ts, remove_spike=False):
     return autocorr(ts, remove_spike=remove_spike)
+
+
+def short_lag_acf(ts, k):
+    """
+    Calculate autocorrelation only up to lag k, normalizing time series to 
+    zero mean and unit variance. Matches autocorr(ts)[:k+1].
+    """
+    ts = np.asarray(ts, dtype=float)
+    acf = _acf_numba(ts, min(k, len(ts) - 1))
+    acf /= acf[0]
+    return acf
+    
+
+def _ks_expon(ts):
+    """
+    Kolmogorov-Smirnov statistic of time series against a unit exponential 
+    distribution, equivalent to scipy.stats.kstest(ts, 'expon').statistic.
+    """
+    x = np.sort(ts)
+    n = len(x)
+    # Exponential CDF, which is 0 for negative intensities
+    cdf = np.maximum(-np.expm1(-x), 0)
+    d_plus = np.max(np.arange(1, n + 1) / n - cdf)
+    d_minus = np.max(cdf - np.arange(0, n) / n)
+    return max(d_plus, d_minus)
     
 
-def get_diag_stats(ts, dt=None, pow=5/3, use_triangle=True):
+def get_diag_stats(ts, dt=None, pow=5/3, use_triangle=True, 
+                   compute=('std', 'min', 'ks', 'lag1', 'lag2', 'fit'),
+                   return_acf=False):
     """
     Calculate statistics based on normalized time series (to mean 1).
 
     If the time resolution dt is given, then scale ACF-fit pixel parameters to 
-    the time resolution.
+    the time resolution. Only statistics named in compute are calculated, 
+    out of 'std', 'min', 'ks', 'anderson', 'lag1', 'lag2', and 'fit' (for 
+    all ACF fit parameters); the rest are None. The Anderson-Darling 
+    statistic is not computed by default. If return_acf is True, also return 
+    the computed autocorrelation, so callers don't have to recompute it.
     """
-    diag_stats = {}
+    diag_stats = {
+        'std': None,
+        'min': None,
+        'ks': None,
+        'anderson': None,
+        'lag1': None,
+        'lag2': None,
+        'fit_t_d': None,
+        'fit_A': None,
+        'fit_W': None,
+    }
     
     # diag_stats['fchans'] = len(ts)
-    diag_stats['std'] = np.std(ts)
-    diag_stats['min'] = np.min(ts)
+    if 'std' in compute:
+        diag_stats['std'] = np.std(ts)
+    if 'min' in compute:
+        diag_stats['min'] = np.min(ts)
     
     # relu_ts = np.where(ts >= 0, ts, 1e-3)
     relu_ts = ts
-    diag_stats['ks'] = scipy.stats.kstest(relu_ts, 
-                                          'expon').statistic
-    diag_stats['anderson'] = scipy.stats.anderson(relu_ts,
-                                                  'expon').statistic
-
-    ac = autocorr(ts)
-    diag_stats['lag1'] = ac[1]
-    diag_stats['lag2'] = ac[2]
+    if 'ks' in compute:
+        diag_stats['ks'] = _ks_expon(relu_ts)
+    if 'anderson' in compute:
+        diag_stats['anderson'] = scipy.stats.anderson(relu_ts,
+                                                      'expon').statistic
+
+    if 'fit' in compute or return_acf:
+        ac = autocorr(ts)
+    elif 'lag1' in compute or 'lag2' in compute:
+        # Only short lags are needed
+        ac = short_lag_acf(ts, 2)
+    if 'lag1' in compute:
+        diag_stats['lag1'] = ac[1]
+    if 'lag2' in compute:
+        diag_stats['lag2'] = ac[2]
     
-    try:
-        popt = fit_acf(ac, pow=pow, use_triangle=use_triangle)
-    except RuntimeError:
-        popt = [np.nan, np.nan, np.nan]
-    diag_stats['fit_t_d'] = popt[0]
-    diag_stats['fit_A'] = popt[1]
-    diag_stats['fit_W'] = popt[2]
-
-    if dt is not None:
-        diag_stats['fit_t_d'] = diag_stats['fit_t_d'] * dt
+    if 'fit' in compute:
+        try:
+            popt = fit_acf(ac, pow=pow, use_triangle=use_triangle)
+        except RuntimeError:
+            popt = [np.nan, np.nan, np.nan]
+        diag_stats['fit_t_d'] = popt[0]
+        diag_stats['fit_A'] = popt[1]
+        diag_stats['fit_W'] = popt[2]
+
+        if dt is not None:
+            diag_stats['fit_t_d'] = diag_stats['fit_t_d'] * dt
     
+    if return_acf:
+        return diag_stats, ac
     return diag_stats
 
 
@@ -102,9 +192,49 @@ def empty_diag_stats(fchans):
     return diag_stats
 
 
+def _is_integer(value):
+    return (isinstance(value, (int, np.integer)) 
+            and not isinstance(value, (bool, np.bool_)))
+
+
+def fill_stats(stats_columns, stats, i, n):
+    """
+    Write statistics for one signal into position i of columns of length n,
+    creating each column the first time its key appears. Signals should be
+    filled in order. As when pandas infers dtypes from a list, columns stay 
+    integer while every value is an integer; otherwise they are floats, with 
+    missing (None) values left as NaN.
+
+    Parameters
+    ----------
+    stats_columns : dict
+        Dictionary of statistic arrays, updated in place
+    stats : dict
+        Dictionary of statistics for one signal
+    i : int
+        Position of signal
+    n : int
+        Total number of signals
+    """
+    for key, value in stats.items():
+        column = stats_columns.get(key)
+        if column is None:
+            if i == 0 and _is_integer(value):
+                column = np.zeros(n, dtype=np.int64)
+            else:
+                column = np.full(n, np.nan)
+            stats_columns[key] = column
+        elif column.dtype.kind == 'i' and not _is_integer(value):
+            # Switch to floats, keeping the integers already written
+            column = column.astype(float)
+            column[i:] = np.nan
+            stats_columns[key] = column
+        if value is not None:
+            column[i] = value
+
+
 def triangle(x, L):
-    y = 1 - np.abs(x) / L
-    return np.where(np.abs(x) <= L, y, 0)
+    return np.maximum(1. - np.abs(x) * (1. / L), 0.)
 
 
 def scint_acf(x, t_d, pow=5/3):
@@ -113,22 +243,43 @@ def scint_acf(x, t_d, pow=5/3):
     """
     return np.exp(-(np.abs(x / t_d))**pow)
 
+
+@njit(cache=True, error_model='numpy')
+def _noisy_scint_acf(x, t_d, A, W, pow, L, use_triangle):
+    """
+    Compiled single-pass evaluation of the noisy ACF model, with the 
+    triangle width L precomputed. Uses NumPy's error model and no fastmath,
+    since t_d may sit at its lower fit bound of 0, where division must give
+    inf/NaN as NumPy would rather than raise ZeroDivisionError.
+    """
+    out = np.empty(x.shape[0])
+    inv_L = 1. / L
+    for i in range(x.shape[0]):
+        v = A * np.exp(-np.abs(x[i] / t_d)**pow)
+        if use_triangle:
+            v *= max(1. - np.abs(x[i]) * inv_L, 0.)
+        out[i] = v
+    out[0] += W
+    return out
+
+
 def noisy_scint_acf(x, t_d, A, W, pow=5/3, use_triangle=True):
     """
     pow is 2 for square-law; 5/3 for Kolmogorov.
     use_triangle weights the acf model by the triangular function for the acf calculation.
     """
-    if use_triangle:
-        factor = triangle(x, len(x) * (x[1] - x[0]))
-    else:
-        factor = 1
-    return A * scint_acf(x, t_d, pow=pow) * factor + W * scipy.signal.unit_impulse(len(x))
+    x = np.asarray(x, dtype=float)
+    L = len(x) * (x[1] - x[0])
+    return _noisy_scint_acf(x, t_d, A, W, float(pow), L, use_triangle)
 
 def noisy_scint_acf_gen(pow=5/3, use_triangle=True):
     """
     pow is 2 for square-law; 5/3 for Kolmogorov.
     """
-    return lambda x, t_d, A, W: noisy_scint_acf(x, t_d, A, W, pow=pow, use_triangle=use_triangle)
+    pow = float(pow)
+    def t_acf_func(x, t_d, A, W):
+        return _noisy_scint_acf(x, t_d, A, W, pow, len(x) * (x[1] - x[0]), use_triangle)
+    return t_acf_func
 
 # def acf_func(x, A, sigma, Y=0):
 #     return A * stg.func_utils.gaussian(x, 0, sigma) + Y * scipy.signal.unit_impulse(len(x))
@@ -144,7 +295,7 @@ def fit_acf(acf, pow=5/3, use_triangle=True, remove_spike=False):
         t_acf_func = lambda x, t_d: noisy_scint_acf_gen(pow=pow, 
                                                         use_triangle=use_triangle)(x, t_d, 1, 0)
         popt, a = optimize.curve_fit(t_acf_func, 
-                                 np.arange(1, len(acf)),
+                                 np.arange(1, len(acf), dtype=float),
                                  acf[1:],
                                  bounds=([0], [len(acf)]))
         return [popt[0], 1, 0]
@@ -153,7 +304,7 @@ def fit_acf(acf, pow=5/3, use_triangle=True, remove_spike=False):
         t_acf_func = noisy_scint_acf_gen(pow=pow, 
                                          use_triangle=use_triangle)
         popt, a = optimize.curve_fit(t_acf_func, 
-                                     np.arange(len(acf)),
+                                     np.arange(len(acf), dtype=float),
                                      acf,
                                      bounds=([0, 0, 0], [len(acf), 1, 1]))
         return popt
@@ -252,7 +403,7 @@ def ts_ac_plot(ts_arr, t_d, dt, p=2):
         
     j = 0
     for ts in ts_arr:
-        ac = autocorr(ts)
+        ac = short_lag_acf(ts, p)
         if j==0:
             print(ac.shape)
             j=1
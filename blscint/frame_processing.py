@@ -43,6 +43,45 @@ def tnorm(frame, divide_std=False, as_data=None):
     return n_frame
 
 
+def tnorm_slice_integrate(frame, l, r, divide_std=False, as_data=None):
+    """
+    Get time series normalized to mean 1 from frequency bounds [l, r), 
+    background subtracted as in tnorm. Equivalent to integrating 
+    tnorm(frame).get_slice(l, r) along frequency, but only the bounded 
+    columns are normalized and no intermediate frames are created.
+
+    Parameters
+    ----------
+    frame : stg.Frame
+        Raw spectrogram frame
+    l : int
+        Left bound
+    r : int
+        Right bound
+    divide_std : bool, optional
+        Normalize each spectrum by dividing by its standard deviation 
+    as_data : stg.Frame, optional
+        Use alternate frame to compute noise stats. If desired, use a more
+        isolated region of time-frequency space for cleaner computation.
+
+    Returns
+    -------
+    ts : np.ndarray
+        Normalized time series
+    """
+    if as_data is not None:
+        data = as_data.data
+    else:
+        data = frame.data
+    clipped_data = sigma_clip(data, axis=1, masked=True)
+    # Mean over the slice commutes with per-spectrum background subtraction
+    ts = np.mean(frame.data[:, l:r], axis=1) - np.mean(clipped_data, axis=1)
+    if divide_std:
+        ts /= np.std(clipped_data, axis=1)
+    ts /= np.mean(ts)
+    return np.asarray(ts)
+
+
 def extract_ts(frame, bound='threshold', divide_std=True, as_data=None):
     """
     Extract normalized time series from dedrifted frame with centered signal, 
@@ -57,8 +96,10 @@ def extract_ts(frame, bound='threshold', divide_std=True, as_data=None):
     else:
         raise ValueError("Bound should be either 'threshold' or 'snr'")
     
-    n_frame = tnorm(frame, divide_std=divide_std, as_data=as_data)
-    tr_frame = n_frame.get_slice(l, r)
+    # Only normalize the bounded region, with noise stats from the full frame
+    if as_data is None:
+        as_data = frame
+    tr_frame = tnorm(frame.get_slice(l, r), divide_std=divide_std, as_data=as_data)
     # ts = tr_frame.integrate('f')
     # ts = ts / np.mean(ts)
     ts = stg.integrate(tr_frame, axis='f', as_frame=True)
@@ -1,8 +1,8 @@
 from pathlib import Path
 import pandas as pd 
-import setigen as stg
 
 from . import frame_processing
+from .dataframe import FrameLoader
 
 
 class HitParser(object):
@@ -43,16 +43,19 @@ class HitParser(object):
         # Populates once you attempt to access observational data
         self.frame_metadata = None
 
+        # Data loaders, so that hits in the same file share reads
+        self._loaders = {}
+
     def centered_frame(self, idx, fchans=256, data_fn=None):
         """
         Create setigen frame centered around a given signal hit, 
         specified by its index in the dataframe. 
         """
-        signal_info = self.df.loc[idx]
-        drift_rate = signal_info["DriftRate"]
-        center_freq = signal_info["Uncorrected_Frequency"]
+        # Scalar lookups avoid building a Series for each hit
+        drift_rate = self.df.at[idx, "DriftRate"]
+        center_freq = self.df.at[idx, "Uncorrected_Frequency"]
         if data_fn is None:
-            data_fn = signal_info["data_fn"]
+            data_fn = self.df.at[idx, "data_fn"]
         if self.frame_metadata is None:
             # Make the assumption that all file metadata is consistent
             self.frame_metadata = frame_processing.get_metadata(data_fn)
@@ -70,7 +73,10 @@ class HitParser(object):
         
         f_start = adj_center_freq - (fchans / 2 + adj_fchans[0]) * df / 1e6
         f_stop = adj_center_freq + (fchans / 2 + adj_fchans[1]) * df / 1e6
-        frame = stg.Frame(data_fn, f_start=f_start, f_stop=f_stop)
+        data_fn = str(data_fn)
+        if data_fn not in self._loaders:
+            self._loaders[data_fn] = FrameLoader(data_fn)
+        frame = self._loaders[data_fn].frame(f_start, f_stop)
             
         frame.add_metadata({
             'drift_rate': drift_rate,
@@ -66,9 +66,20 @@ class SignalManager(object):
             if j == 0:
                 axs[j].set_ylabel('Counts')
             
-            all_vals = np.hstack([filter['df'][stat] for filter in filters])
-            # all_vals = all_vals[np.isfinite(all_vals)]
-            bins=np.histogram(all_vals, bins=kwargs.get('bins', 40))[1]
+            bins = kwargs.get('bins', 40)
+            if isinstance(bins, str):
+                # Bin width estimators (e.g. 'auto', 'fd') need the data
+                all_vals = np.hstack([filter['df'][stat] for filter in filters])
+                bins = np.histogram(all_vals, bins=bins)[1]
+            elif np.ndim(bins) == 0:
+                # Only bin edges are needed, which span the full range of values
+                all_vals = [filter['df'][stat] for filter in filters 
+                            if len(filter['df']) > 0]
+                lo = min(np.nanmin(vals) for vals in all_vals)
+                hi = max(np.nanmax(vals) for vals in all_vals)
+                if lo == hi:
+                    lo, hi = lo - 0.5, hi + 0.5
+                bins = np.linspace(lo, hi, bins + 1)
 
             for i, filter in enumerate(filters):
                 axs[j].hist(filter['df'][stat], 
@@ -1,5 +1,6 @@
 from .timeseries import (
-    get_ts_arta, get_ts_fft, get_ts_pdf, SignalGenerator, synthesize_dataset,
+    get_ts_arta, get_ts_fft, get_ts_pdf, get_ts_pdf_batch, 
+    SignalGenerator, synthesize_dataset,
 )
 
 from .screens import c95, hl07, rd18
\ No newline at end of file
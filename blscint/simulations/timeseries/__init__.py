@@ -1,5 +1,5 @@
 from .arta import get_ts_arta
 from .fft import get_ts_fft
-from .pdf import get_ts_pdf
+from .pdf import get_ts_pdf, get_ts_pdf_batch
 
 from .dataset_gen import SignalGenerator, synthesize_dataset
\ No newline at end of file
@@ -84,7 +84,7 @@ def psi(r):
     return scipy.linalg.toeplitz(np.concatenate([[1.], r[:-1]]))
 
 
-def build_Z(r, T, seed=None):
+def build_Z(r, T, seed=None, batch=None):
     """
     Build full baseline Z array.
 
@@ -96,11 +96,14 @@ def build_Z(r, T, seed=None):
         Final length of array Z, should be greater than p
     seed : None, int, Generator, optional
         Random seed or seed generator
+    batch : int, optional
+        Number of independent Z arrays to build at once. If None, build a 
+        single 1D array.
 
     Returns
     -------
     Z : np.ndarray
-        Array of Z values, as in ARTA
+        Array of Z values, as in ARTA, with shape (T,) or (batch, T)
     """
     rng = np.random.default_rng(seed)
 
@@ -110,7 +113,11 @@ def build_Z(r, T, seed=None):
     p = len(r)
     assert T >= p
 
-    Z = np.zeros(T)
+    if batch is None:
+        n = 1
+    else:
+        n = batch
+    Z = np.zeros((n, T))
     covariance = psi(r) 
     
     min_eig = np.min(np.real(np.linalg.eigvals(covariance)))
@@ -122,7 +129,7 @@ def build_Z(r, T, seed=None):
 #     print(np.linalg.eigvalsh(covariance))
     _ = np.linalg.cholesky(covariance)
 
-    Z[:p] = rng.multivariate_normal(np.zeros(p), covariance)
+    Z[:, :p] = rng.multivariate_normal(np.zeros(p), covariance, size=n)
     alpha = np.dot(r, np.linalg.inv(covariance))
 #     print(np.abs(np.roots([1.]+list(-alpha))))
     try:
@@ -136,9 +143,13 @@ def build_Z(r, T, seed=None):
     except AssertionError:
         raise RuntimeError('Variance of epsilon is negative!')
 
+    # Step the AR process for all series in the batch at once
+    epsilon = rng.normal(0, np.sqrt(variance), size=(n, T - p))
     for i in range(p, T):
-        epsilon = rng.normal(0, np.sqrt(variance))
-        Z[i] = np.dot(alpha, Z[i-p:i][::-1]) + epsilon
+        Z[:, i] = np.dot(Z[:, i-p:i][:, ::-1], alpha) + epsilon[:, i - p]
+
+    if batch is None:
+        return Z[0]
     return Z
 
 
@@ -178,16 +189,18 @@ def get_Y(Z, dist='exp'):
     Returns
     -------
     Y : np.ndarray
-        Final synthetic scintillated time series (Y values)
+        Final synthetic scintillated time series (Y values), each normalized
+        along the last axis
     """
     if dist == 'exp':
         Y = inv_exp_cdf(norm.cdf(Z))
     else:
         Y = inv_levy_cdf(norm.cdf(Z))
-    return Y / np.mean(Y)
+    return Y / np.mean(Y, axis=-1, keepdims=True)
 
 
-def get_ts_arta(t_d, dt, num_samples, p=2, pow=5/3, dist='exp', seed=None):
+def get_ts_arta(t_d, dt, num_samples, p=2, pow=5/3, dist='exp', seed=None, 
+                batch=None):
     """
     Produce time series data via an ARTA process. 
 
@@ -205,15 +218,19 @@ def get_ts_arta(t_d, dt, num_samples, p=2, pow=5/3, dist='exp', seed=None):
         Exponent for ACF fit, either 5/3 or 2 (arising from phase structure function) 
     seed : None, int, Generator, optional
         Random seed or seed generator
+    batch : int, optional
+        Number of independent time series to produce at once. If None, 
+        produce a single 1D time series.
 
     Returns
     -------
     Y : np.ndarray
-        Final synthetic scintillated time series (Y values)
+        Final synthetic scintillated time series (Y values), with shape 
+        (num_samples,) or (batch, num_samples)
     """
     rng = np.random.default_rng(seed)
     rho = get_rho(t_d, dt, p, pow)
-    Z = build_Z(rho, num_samples, seed=rng)
+    Z = build_Z(rho, num_samples, seed=rng, batch=batch)
     Y = get_Y(Z, dist)
     return Y
 
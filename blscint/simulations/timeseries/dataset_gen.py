@@ -1,22 +1,156 @@
+import os
 from pathlib import Path
+import functools
+import multiprocessing
 import click 
-import collections
 import numpy as np
 import pandas as pd
 import tqdm
 import setigen as stg
 
 from blscint import simulations
+from blscint.simulations.timeseries import fft
 from blscint import frame_processing
 from blscint import diag_stats
 
 
+def _noise_amplitude(frame_metadata, t_d, pow=5/3):
+    """
+    FFT noise amplitude for signals with the given observation metadata 
+    and scintillation timescale.
+    """
+    return fft._noise_amplitude(fft._compute_spectrum(t_d,
+                                                      frame_metadata['dt'],
+                                                      frame_metadata['tchans'],
+                                                      pow=pow))
+
+
+def _run_trial(frame_metadata, 
+               rng,
+               t_d, 
+               snr=25,
+               bw=2,
+               injected=False,
+               bound='threshold',
+               gen_method='arta',
+               pow=5/3, 
+               divide_std=True,
+               p=None,
+               ts=None,
+               amplitude=None,
+               workspace=None):
+    """
+    Synthesize a single scintillated signal and compute its diagnostic 
+    statistics.
+
+    Parameters
+    ----------
+    frame_metadata : dict
+        Dictionary with 'dt', 'df', and 'tchans' of the synthetic observations
+    rng : Generator
+        Random number generator
+    t_d : float
+        Scintillation timescale (s)
+    ts : np.ndarray, optional
+        Pre-generated intensity time series, used instead of synthesizing one
+    amplitude : np.ndarray, optional
+        FFT noise amplitude, shared between 'fft' trials
+    workspace : dict, optional
+        Scratch buffers for 'fft' trials, reused between calls
+
+    Other parameters are as in SignalGenerator.make_dataset.
+
+    Returns
+    -------
+    ts_stats : dict
+        Dictionary of statistics, or None if the signal wasn't bounded
+    ts : np.ndarray
+        Extracted intensity time series, or None if not injected
+    """
+    if ts is None:
+        if gen_method == 'arta':
+            if p is None:
+                p = frame_metadata['tchans'] // 4
+            ts = simulations.get_ts_arta(t_d, 
+                                         frame_metadata['dt'],
+                                         frame_metadata['tchans'],
+                                         p=p,
+                                         pow=pow,
+                                         seed=rng)
+        elif gen_method == 'fft':
+            if amplitude is None:
+                amplitude = _noise_amplitude(frame_metadata, t_d, pow=pow)
+            ts = fft._ts_from_spectrum(amplitude, rng, workspace=workspace)
+        elif gen_method == 'pdf':
+            ts = simulations.get_ts_pdf(t_d,
+                                        frame_metadata['dt'],
+                                        frame_metadata['tchans'],
+                                        seed=rng)
+        else:
+            raise ValueError("Generation method must be one of 'arta', 'fft', or 'pdf'")
+    l = r = fchans = None
+    extracted_ts = None
+
+    if injected:
+        frame = stg.Frame(fchans=256,
+                          tchans=frame_metadata['tchans'],
+                          df=frame_metadata['df'],
+                          dt=frame_metadata['dt'],
+                          seed=rng)
+        frame.add_noise_from_obs()
+        signal = frame.add_signal(stg.constant_path(f_start=frame.get_frequency(128), 
+                                                    drift_rate=0),
+                                  ts * frame.get_intensity(snr=snr),
+                                  stg.sinc2_f_profile(width=bw*frame.df, 
+                                                      width_mode="crossing"),
+                                  stg.constant_bp_profile(level=1))
+
+        try:
+            ts, (l, r) = frame_processing.extract_ts(frame,
+                                                     bound=bound,
+                                                     divide_std=divide_std,
+                                                     as_data=frame.get_slice(0, frame.fchans//2-bw//2))
+            # TimeSeries.array() is a view of the frame data, not a copy
+            if not isinstance(ts, np.ndarray):
+                ts = ts.array()
+            extracted_ts = ts
+        except IndexError:
+            # Signal not bound by bounding algorithm 
+            ts = None 
+        fchans = frame.fchans
+        
+    if ts is None:
+        return None, None
+
+    ts_stats = diag_stats.get_diag_stats(ts, 
+                                         dt=frame_metadata['dt'])
+    ts_stats.update({
+        'fchans': fchans,
+        't_d': t_d,
+        'l': l,
+        'r': r,
+        'SNR': snr,
+        'DriftRate': 0,
+    })
+    return ts_stats, extracted_ts
+
+
+def _seeded_trial(seed, **kwargs):
+    """
+    Run a single trial with a generator built from seed (such as a child 
+    SeedSequence), for use in worker processes.
+    """
+    return _run_trial(rng=np.random.default_rng(seed), **kwargs)
+
+
 class SignalGenerator(object):
     """
     Class to synthesize scintillated signals for use in thresholding.
     """
     def __init__(self, dt, df, tchans, seed=None, **kwargs):
         self.rng = np.random.default_rng(seed)
+        # Parent of independent child streams for worker processes
+        self.seed_seq = self.rng.bit_generator.seed_seq
 
         self.frame_metadata = {
             'dt': dt,
@@ -37,90 +171,92 @@ class SignalGenerator(object):
                      divide_std=True,
                      file_stem=None, 
                      save_ts=False,
-                     p=None):
+                     p=None,
+                     processes=1):
         """
         Create dataset of synthetic scintillated signals, and save
         statistic details to csv. 
 
-        gen_method is either 'arta' or 'fft'.
+        gen_method is one of 'arta', 'fft', or 'pdf'. If processes is not 1, 
+        trials are split over that many worker processes (or all available 
+        CPUs if None), each with an independent stream spawned from the 
+        generator's SeedSequence.
         """
         if file_stem is not None:
             stem_path = Path(file_stem)
             csv_path = stem_path.parent / f"{stem_path.name}.diagstat.csv"
             tsdump_path = stem_path.parent / f"{stem_path.name}.tsdump.npy"
         
-        stats_df = pd.DataFrame()
-        ts_stats_dict = collections.defaultdict(list)
+        # Statistic columns, trimmed to bounded signals at the end
+        ts_stats_dict = {}
+        n_stats = 0
         if save_ts:
+            # Single precision is plenty for intensities, and halves memory
             tsdump = np.full((n, self.frame_metadata['tchans']), 
-                             np.nan)
-        for idx in tqdm.trange(n):
-            if gen_method == 'arta':
-                if p is None:
-                    p = self.frame_metadata['tchans'] // 4
-                ts = simulations.get_ts_arta(t_d, 
-                                             self.frame_metadata['dt'],
-                                             self.frame_metadata['tchans'],
-                                             p=p,
-                                             pow=pow,
-                                             seed=self.rng)
-            elif gen_method == 'fft':
-                ts = simulations.get_ts_fft(t_d,
-                                            self.frame_metadata['dt'],
-                                            self.frame_metadata['tchans'],
-                                            pow=pow,
-                                            seed=self.rng)
-            else:
-                raise ValueError("Generation method must be either 'arta' or 'fft'")
-            l = r = fchans = None
-
-            if injected:
-                frame = stg.Frame(fchans=256,
-                                  tchans=self.frame_metadata['tchans'],
-                                  df=self.frame_metadata['df'],
-                                  dt=self.frame_metadata['dt'],
-                                  seed=self.rng)
-                frame.add_noise_from_obs()
-                signal = frame.add_signal(stg.constant_path(f_start=frame.get_frequency(128), 
-                                                            drift_rate=0),
-                                            ts * frame.get_intensity(snr=snr),
-                                            stg.sinc2_f_profile(width=bw*frame.df, 
-                                                                width_mode="crossing"),
-                                            stg.constant_bp_profile(level=1))
-
-                try:
-                    ts, (l, r) = frame_processing.extract_ts(frame,
-                                                             bound=bound,
-                                                             divide_std=divide_std,
-                                                             as_data=frame.get_slice(0, frame.fchans//2-bw//2))
-                except IndexError:
-                    # Signal not bound by bounding algorithm 
-                    ts = None 
-            
+                             np.nan,
+                             dtype=np.float32)
+        trial_kwargs = {
+            'frame_metadata': self.frame_metadata,
+            't_d': t_d,
+            'snr': snr,
+            'bw': bw,
+            'injected': injected,
+            'bound': bound,
+            'gen_method': gen_method,
+            'pow': pow,
+            'divide_std': divide_std,
+            'p': p,
+        }
+        if gen_method == 'fft':
+            # Spectrum only depends on the ACF, so share it across trials
+            trial_kwargs['amplitude'] = _noise_amplitude(self.frame_metadata, 
+                                                         t_d, 
+                                                         pow=pow)
+        elif gen_method not in ('arta', 'pdf'):
+            raise ValueError("Generation method must be one of 'arta', 'fft', or 'pdf'")
+
+        pool = None
+        if processes == 1:
+            workspace = None
+            ts_batch = [None] * n
+            if gen_method == 'fft':
+                workspace = fft._fft_workspace(self.frame_metadata['tchans'])
+            elif gen_method == 'pdf':
+                # Chains are independent, so walk them all at once
+                ts_batch = simulations.get_ts_pdf_batch(t_d,
+                                                        self.frame_metadata['dt'],
+                                                        self.frame_metadata['tchans'],
+                                                        n,
+                                                        seed=self.rng)
+            results = (_run_trial(rng=self.rng, ts=ts, workspace=workspace, **trial_kwargs)
+                       for ts in ts_batch)
+        else:
+            # Stream results back in order, so seeded datasets are reproducible
+            n_workers = processes or os.cpu_count()
+            chunksize = max(1, n // (4 * n_workers))
+            child_seqs = self.seed_seq.spawn(n)
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap(functools.partial(_seeded_trial, **trial_kwargs),
+                                child_seqs,
+                                chunksize=chunksize)
+
+        try:
+            for idx, (ts_stats, ts) in enumerate(tqdm.tqdm(results, total=n)):
                 if save_ts and ts is not None:
-                    tsdump[idx, :] = ts
-                fchans = frame.fchans
-                
-            if ts is not None:
-                ts_stats = diag_stats.get_diag_stats(ts, 
-                                                    dt=self.frame_metadata['dt'])
-                ts_stats.update({
-                    'fchans': fchans,
-                    't_d': t_d,
-                    'l': l,
-                    'r': r,
-                    'SNR': snr,
-                    'DriftRate': 0,
-                })
-
-                for stat in ts_stats:
-                    ts_stats_dict[stat].append(ts_stats[stat])
-
-        # Set statistic columns
-        for stat in ts_stats_dict:
-            stats_df[stat] = ts_stats_dict[stat]
-
-        stats_df['real'] = False
+                    np.copyto(tsdump[idx], ts)
+
+                if ts_stats is not None:
+                    diag_stats.fill_stats(ts_stats_dict, ts_stats, n_stats, n)
+                    n_stats += 1
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        # Build all statistic columns at once
+        stats_df = pd.DataFrame({
+            **{stat: ts_stats_dict[stat][:n_stats] for stat in ts_stats_dict},
+            'real': np.full(n_stats, False),
+        })
 
         if self.df is None:
             self.df = stats_df 
@@ -1,8 +1,128 @@
+import functools
 import numpy as np
+import scipy.fft
 from blscint import diag_stats
 
 
-def get_ts_fft(t_d, dt, num_samples, pow=5/3, seed=None):
+@functools.lru_cache(maxsize=32)
+def _compute_spectrum(t_d, dt, num_samples, pow=5/3):
+    """
+    Compute power spectrum of the intensity ACF, from which FFT time series
+    are generated. Cached, since repeated calls usually share parameters.
+
+    Parameters
+    ----------
+    t_d : float
+        Scintillation timescale (s)
+    dt : float
+        Time resolution (s)
+    num_samples : int
+        Number of synthetic samples to produce
+    pow : float, optional
+        Exponent for ACF fit, either 5/3 or 2 (arising from phase structure function) 
+
+    Returns
+    -------
+    spectrum : np.ndarray
+        Read-only power spectrum, of length num_samples
+    """
+    lags = np.arange(num_samples) - num_samples / 2
+    lags = np.fft.fftshift(lags)
+
+    acf = diag_stats.scint_acf(lags, t_d / dt * 2**(1/pow), pow=pow)
+    # Real part of the FFT of a real sequence is even, so only compute the
+    # non-negative frequencies and mirror them
+    half_spectrum = scipy.fft.rfft(acf).real
+    spectrum = np.concatenate([half_spectrum, 
+                               half_spectrum[1:num_samples - len(half_spectrum) + 1][::-1]])
+    spectrum.flags.writeable = False
+    return spectrum
+
+
+def _noise_amplitude(spectrum):
+    """
+    Amplitude applied to each complex noise sample. Each of the real and 
+    imaginary parts has unit variance, so take the square root of half the 
+    power spectrum, once per spectrum rather than once per trial.
+
+    Parameters
+    ----------
+    spectrum : np.ndarray
+        Power spectrum
+
+    Returns
+    -------
+    amplitude : np.ndarray
+        Square root of half the power spectrum
+    """
+    return np.sqrt(spectrum / 2)
+
+
+def _fft_workspace(num_samples):
+    """
+    Allocate scratch buffers for _ts_from_spectrum, so that repeated trials 
+    can reuse them.
+
+    Parameters
+    ----------
+    num_samples : int
+        Number of synthetic samples to produce
+
+    Returns
+    -------
+    workspace : dict
+        Dictionary of preallocated complex field and intensity arrays 
+    """
+    return {
+        'work': np.empty(num_samples, dtype=np.complex128),
+        'I': np.empty(num_samples),
+    }
+
+
+def _ts_from_spectrum(amplitude, rng, workspace=None, workers=None, 
+                      normalize=True):
+    """
+    Produce time series data from the noise amplitude of a precomputed power 
+    spectrum, drawing fresh noise.
+
+    Parameters
+    ----------
+    amplitude : np.ndarray
+        Noise amplitude from _noise_amplitude
+    rng : Generator
+        Random number generator
+    workspace : dict, optional
+        Scratch buffers from _fft_workspace, reused across calls
+    workers : int, optional
+        Maximum number of threads for the inverse FFT, as in scipy.fft
+    normalize : bool, optional
+        Whether to divide intensities by their sample mean. Otherwise, 
+        amplitude should already be scaled for unit mean intensity.
+
+    Returns
+    -------
+    Y : np.ndarray
+        Final synthetic scintillated time series, in single precision
+    """
+    if workspace is None:
+        workspace = _fft_workspace(len(amplitude))
+    # Draw real and imaginary parts straight into the complex buffer
+    work = workspace['work']
+    rng.standard_normal(out=work.view(np.float64))
+    work *= amplitude
+
+    # Complex field, so that intensities are exponentially distributed
+    I = workspace['I']
+    np.abs(scipy.fft.ifft(work, overwrite_x=True, workers=workers), out=I)
+    np.square(I, out=I)
+    # Return a new array, since the buffers are overwritten on the next call
+    if normalize:
+        I /= np.mean(I)
+    return I.astype(np.float32)
+
+
+def get_ts_fft(t_d, dt, num_samples, pow=5/3, seed=None, workers=None,
+               analytic_norm=False):
     """
     Produce time series data via FFT/IFFT. Based on code from Jim Cordes.
 
@@ -18,20 +138,26 @@ def get_ts_fft(t_d, dt, num_samples, pow=5/3, seed=None):
         Exponent for ACF fit, either 5/3 or 2 (arising from phase structure function) 
     seed : None, int, Generator, optional
         Random seed or seed generator
+    workers : int, optional
+        Maximum number of threads for the inverse FFT, as in scipy.fft.
+        Use -1 for all CPUs on long series, but leave as default inside 
+        worker processes to avoid oversubscription.
+    analytic_norm : bool, optional
+        Scale the spectrum so that intensities have unit mean in expectation,
+        rather than dividing each realization by its sample mean
 
     Returns
     -------
     Y : np.ndarray
-        Final synthetic scintillated time series
+        Final synthetic scintillated time series, in single precision
     """
     rng = np.random.default_rng(seed)
-    lags = np.linspace(0, num_samples - 1, num_samples) - num_samples / 2
-    lags = np.fft.fftshift(lags)
-
-    noise = (rng.standard_normal(num_samples) + 1j * rng.standard_normal(num_samples)) / np.sqrt(2)
-    spectrum = np.fft.fft(diag_stats.scint_acf(lags, 
-                                               t_d / dt * 2**(1/pow), 
-                                               pow=pow)).real
-
-    I = np.abs(np.fft.ifft(noise * np.sqrt(spectrum)))**2
-    return I / np.mean(I)
+    spectrum = _compute_spectrum(t_d, dt, num_samples, pow=pow)
+    amplitude = _noise_amplitude(spectrum)
+    if analytic_norm:
+        # By Parseval, E[|ifft(noise * amplitude)|^2] = sum(spectrum) / N^2
+        amplitude *= num_samples / np.sqrt(np.sum(spectrum))
+    return _ts_from_spectrum(amplitude, 
+                             rng, 
+                             workers=workers, 
+                             normalize=not analytic_norm)
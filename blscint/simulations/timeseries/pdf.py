@@ -10,12 +10,12 @@ http://articles.adsabs.harvard.edu/pdf/1991ApJ...376..123C
 Cordes, Lazio, & Sagan 1997:
 https://iopscience.iop.org/article/10.1086/304620/pdf
 """
-import sys
+import functools
 import numpy as np
 from scipy.stats import norm
-import scipy.linalg
+from scipy.special import ive
+from numba import njit
 
-import setigen as stg
 from setigen.funcs import func_utils
 from blscint import factors
 from blscint import diag_stats
@@ -41,6 +41,58 @@ def find_nearest(arr, val):
     return idx
 
 
+def find_nearest_sorted(arr, val):
+    """
+    Return index of closest value in a monotonically increasing array, 
+    via binary search.
+
+    Parameters
+    ----------
+    arr : np.ndarray
+        Sorted input array
+    val : float
+        Target value
+
+    Returns
+    -------
+    idx : int
+        Closest index
+    """
+    idx = np.searchsorted(arr, val)
+    if idx == 0:
+        return 0
+    if idx == len(arr):
+        return len(arr) - 1
+    # Ties go to the lower index, as in find_nearest
+    return idx - 1 if val - arr[idx - 1] <= arr[idx] - val else idx
+
+
+def log_bpdf(g1, g2, ac):
+    """
+    Calculate log of joint probability of g1, g2 separated by a temporal 
+    auto-correlation value of ac, according to Eq. B12 of Cordes, Lazio, & 
+    Sagan 1997.
+
+    Parameters
+    ----------
+    g1 : float
+        Signal gain 1
+    g2 : float
+        Signal gain 2
+    ac : float
+        Autocorrelation value in [0, 1)
+
+    Returns
+    -------
+    log_f_2g : float
+        Log of joint probability
+    """
+    # Modified Bessel term I0(z) can diverge, so use the exponentially scaled
+    # ive(0, z) = I0(z) * exp(-z) and add z back in log-space.
+    z = 2*np.sqrt(g1*g2*ac)/(1-ac)
+    return -np.log1p(-ac) - (g1+g2)/(1-ac) + z + np.log(ive(0, z))
+
+
 def bpdf(g1, g2, ac):
     """
     Calculate joint probability of g1, g2 separated by a temporal auto-correlation value of ac,
@@ -60,14 +112,172 @@ def bpdf(g1, g2, ac):
     f_2g : float
         Joint probability
     """
-    # Calculate modified Bessel term, which can diverge.
-    i_factor = scipy.special.i0(2*np.sqrt(g1*g2*ac)/(1-ac))
-    # In divergent case, use exponential approximation to simplify terms.
-    if np.any(np.isinf(i_factor)):
-        #https://math.stackexchange.com/questions/376758/exponential-approximation-of-the-modified-bessel-function-of-first-kind-equatio
-        return 1/(1-ac)*np.exp((-(g1+g2)+2*np.sqrt(g1*g2*ac))/(1-ac))*np.sqrt(4*np.pi*np.sqrt(g1*g2*ac)/(1-ac))
-    else:
-        return 1/(1-ac)*np.exp(-(g1+g2)/(1-ac))*i_factor
+    return np.exp(log_bpdf(g1, g2, ac))
+
+
+@njit(cache=True)
+def _walk(cdf_data, cdf_indptr, cdf_offset, init_idx, u):
+    """
+    Walk Markov chain over gain levels by inverse transform sampling on the 
+    banded rows of the transition CDF, using one pre-drawn uniform in [0, 1) 
+    per step.
+
+    Parameters
+    ----------
+    cdf_data : np.ndarray
+        Concatenated truncated CDF rows
+    cdf_indptr : np.ndarray
+        Start of each row in cdf_data, with a final entry for the end
+    cdf_offset : np.ndarray
+        Gain level index of the first entry of each truncated row
+    init_idx : int
+        Initial gain level index
+    u : np.ndarray
+        Uniform random values, one per step after the first
+
+    Returns
+    -------
+    ts_idx : np.ndarray
+        Gain level indices, with length len(u) + 1
+    """
+    ts_idx = np.empty(len(u) + 1, dtype=np.int64)
+    ts_idx[0] = init_idx
+    for i in range(1, len(u) + 1):
+        r = ts_idx[i-1]
+        row = cdf_data[cdf_indptr[r]:cdf_indptr[r+1]]
+        j = np.searchsorted(row, u[i-1], side='right')
+        ts_idx[i] = cdf_offset[r] + min(j, len(row) - 1)
+    return ts_idx
+
+
+@njit(cache=True)
+def _walk_batch(cdf_data, cdf_indptr, cdf_offset, init_idx, u):
+    """
+    Walk independent Markov chains over gain levels, as in _walk.
+
+    Parameters
+    ----------
+    cdf_data : np.ndarray
+        Concatenated truncated CDF rows
+    cdf_indptr : np.ndarray
+        Start of each row in cdf_data, with a final entry for the end
+    cdf_offset : np.ndarray
+        Gain level index of the first entry of each truncated row
+    init_idx : np.ndarray
+        Initial gain level index of each chain
+    u : np.ndarray
+        Uniform random values, with shape (chains, steps after the first)
+
+    Returns
+    -------
+    ts_idx : np.ndarray
+        Gain level indices, with shape (chains, u.shape[1] + 1)
+    """
+    ts_idx = np.empty((len(init_idx), u.shape[1] + 1), dtype=np.int64)
+    for c in range(len(init_idx)):
+        ts_idx[c] = _walk(cdf_data, cdf_indptr, cdf_offset, init_idx[c], u[c])
+    return ts_idx
+
+
+def _transition_cdf(max_g, steps, ac):
+    """
+    Build cumulative transition probabilities between all pairs of possible
+    gain levels, for autocorrelation value ac. Row i is the CDF of the next
+    gain level given current level i.
+
+    Parameters
+    ----------
+    max_g : float
+        Maximum possible gain (for computation)
+    steps : int
+        Number of possible gain levels within [0, `max_g`] (for computation)
+    ac : float
+        Autocorrelation value in [0, 1)
+
+    Returns
+    -------
+    F_cdf : np.ndarray
+        Array of row-wise CDFs, with shape (steps, steps)
+    """
+    possible_g = np.linspace(0, max_g, steps, endpoint=False)
+    G1, G2 = np.meshgrid(possible_g, possible_g, indexing='ij')
+    # Subtract each row's maximum log probability before exponentiating, 
+    # which is undone by the row normalization
+    log_p = log_bpdf(G1, G2, ac)
+    log_p -= log_p.max(axis=1, keepdims=True)
+    F_cdf = np.cumsum(np.exp(log_p), axis=1)
+    F_cdf /= F_cdf[:, -1:]
+    return F_cdf
+
+
+@functools.lru_cache(maxsize=16)
+def _banded_transition_cdf(max_g, steps, ac, tol=1e-10):
+    """
+    Truncate each row of the transition CDF to the gain levels that hold
+    all but `tol` of its probability mass, stored in compressed sparse row 
+    form. For strongly correlated steps, mass concentrates near the diagonal,
+    so sampling only has to search a short band of each row.
+
+    Parameters
+    ----------
+    max_g : float
+        Maximum possible gain (for computation)
+    steps : int
+        Number of possible gain levels within [0, `max_g`] (for computation)
+    ac : float
+        Autocorrelation value in [0, 1)
+    tol : float, optional
+        Probability mass allowed to be cut from each tail of each row
+
+    Returns
+    -------
+    cdf_data : np.ndarray
+        Concatenated truncated CDF rows
+    cdf_indptr : np.ndarray
+        Start of each row in cdf_data, with a final entry for the end
+    cdf_offset : np.ndarray
+        Gain level index of the first entry of each truncated row
+    """
+    F_cdf = _transition_cdf(max_g, steps, ac)
+    # Rows are non-decreasing, so counts give the band edges directly
+    lo = np.count_nonzero(F_cdf <= tol, axis=1)
+    hi = np.count_nonzero(F_cdf < 1 - tol, axis=1)
+    hi = np.maximum(np.minimum(hi, steps - 1), lo)
+
+    cdf_indptr = np.zeros(steps + 1, dtype=np.int64)
+    cdf_indptr[1:] = np.cumsum(hi - lo + 1)
+    # Boolean indexing concatenates the selected entries row by row
+    cols = np.arange(steps)
+    in_band = (cols >= lo[:, np.newaxis]) & (cols <= hi[:, np.newaxis])
+    cdf_data = F_cdf[in_band]
+    cdf_offset = lo.astype(np.int64)
+    for arr in (cdf_data, cdf_indptr, cdf_offset):
+        arr.flags.writeable = False
+    return cdf_data, cdf_indptr, cdf_offset
+
+    
+def _chain_params(t_d, dt, max_g, steps):
+    """
+    Gain levels and banded transition CDF for the gain Markov chain.
+    """
+    ac_arr = func_utils.gaussian(np.arange(0, steps),
+                                 0, 
+                                 t_d / dt / factors.hwem_m)
+    
+    possible_g = np.linspace(0, max_g, steps, endpoint=False)
+    return possible_g, _banded_transition_cdf(max_g, steps, ac_arr[1])
+
+
+def _init_indices(possible_g, max_g, rng, size=None):
+    """
+    Draw initial gain level indices from an exponential truncated to 
+    [0, max_g], by inversion.
+    """
+    init_g = -np.log1p(-rng.uniform(0.0, 1.0 - np.exp(-max_g), size=size))
+    if size is None:
+        return find_nearest_sorted(possible_g, init_g)
+    return np.array([find_nearest_sorted(possible_g, g) for g in init_g],
+                    dtype=np.int64)
 
     
 def get_ts_pdf(t_d, dt, num_samples, max_g=5, steps=1000, seed=None):
@@ -93,43 +303,52 @@ def get_ts_pdf(t_d, dt, num_samples, max_g=5, steps=1000, seed=None):
     Returns
     -------
     Y : np.ndarray
-        Final synthetic scintillated time series (Y values)
+        Final synthetic scintillated time series (Y values), in single precision
     """
     rng = np.random.default_rng(seed)
-    ac_arr = stg.func_utils.gaussian(np.arange(0, steps),
-                                     0, 
-                                     t_d / dt / factors.hwem_m)
+    possible_g, banded_cdf = _chain_params(t_d, dt, max_g, steps)
+    init_idx = _init_indices(possible_g, max_g, rng)
     
-    possible_g = np.linspace(0, max_g, steps, endpoint=False)
-#     F_2g = np.empty(shape=(n, n))
-#     for i in range(n):
-#         F_2g[i, :] = bpdf(possible_g[i], possible_g, rho[1])
-#     F_2g = F_2g / np.sum(F_2g, axis=1, keepdims=True)
+    # Draw uniforms from the Generator, so the compiled walk stays seeded by it
+    ts_idx = _walk(*banded_cdf, init_idx, rng.random(num_samples - 1))
+    Y = possible_g[ts_idx]
+    return Y.astype(np.float32, copy=False)
 
-    ts_idx = np.zeros(num_samples, dtype=int)
 
-    init_g = max_g + 1
-    while init_g > max_g:
-        init_g = rng.exponential()
-    ts_idx[0] = find_nearest(possible_g, init_g)
-    
-    update_freq = int(np.ceil(t_d / dt))
-    for i in range(1, num_samples):
-#         offset = i % update_freq
-#         if offset == 1:
-#             last_i = i - 1
-#         if offset == 0:
-#             offset = update_freq
-#         raw_p = bpdf(possible_g[ts_idx[last_i]], possible_g, ac_arr[offset])
-        
-        raw_p = bpdf(possible_g[ts_idx[i-1]], possible_g, ac_arr[1])
-
-        p = raw_p / np.sum(raw_p)
-        try:
-            ts_idx[i] = rng.choice(np.arange(steps), p=p)
-        except:
-#             print(F_2g[i])
-            print(i)
-            sys.exit(1)
+def get_ts_pdf_batch(t_d, dt, num_samples, n_chains, max_g=5, steps=1000, seed=None):
+    """
+    Produce many independent time series via bivariate pdf for the gain, 
+    as in get_ts_pdf, sharing setup and running all chains in one compiled call.
+
+    Parameters
+    ----------
+    t_d : float
+        Scintillation timescale (s)
+    dt : float
+        Time resolution (s)
+    num_samples : int
+        Number of synthetic samples to produce per time series
+    n_chains : int
+        Number of time series to produce
+    max_g : float, optional
+        Maximum possible gain (for computation)
+    steps : int, optional
+        Number of possible gain levels within [0, `max_g`] (for computation)
+    seed : None, int, Generator, optional
+        Random seed or seed generator
+
+    Returns
+    -------
+    Y : np.ndarray
+        Synthetic scintillated time series in single precision, with shape 
+        (n_chains, num_samples)
+    """
+    rng = np.random.default_rng(seed)
+    possible_g, banded_cdf = _chain_params(t_d, dt, max_g, steps)
+    init_idx = _init_indices(possible_g, max_g, rng, size=n_chains)
+
+    ts_idx = _walk_batch(*banded_cdf, 
+                         init_idx, 
+                         rng.random((n_chains, num_samples - 1)))
     Y = possible_g[ts_idx]
-    return Y
\ No newline at end of file
+    return Y.astype(np.float32, copy=False)